@@ -25,22 +25,40 @@ class OrquestradorAgentes:
         self.analista = AnalistaFiscal()
         self.tributarista = TributaristaFiscal()
         
-    def processar_sequencial(self, 
-                           cabecalho_df: pd.DataFrame, 
+    def processar_sequencial(self,
+                           cabecalho_df: pd.DataFrame,
                            produtos_df: pd.DataFrame,
                            callback_status: Callable[[str], None] = None) -> Dict[str, Any]:
         """
         Executa processamento sequencial dos 3 agentes
-        
+
         Args:
             cabecalho_df: DataFrame criptografado com dados do cabeçalho
             produtos_df: DataFrame criptografado com dados dos produtos
             callback_status: Função callback para atualizar status na interface
-            
+
         Returns:
             dict: Resultados consolidados dos 3 agentes
         """
-        
+        resultado = None
+        for _, resultado in self.iterar_agentes(cabecalho_df, produtos_df, callback_status):
+            pass
+        return resultado
+
+    def iterar_agentes(self,
+                       cabecalho_df: pd.DataFrame,
+                       produtos_df: pd.DataFrame,
+                       callback_status: Callable[[str], None] = None):
+        """
+        Executa os agentes em sequência produzindo cada resultado parcial
+
+        Gera tuplas (etapa, resultado): ('validador', ...), ('analista', ...),
+        ('tributarista', ...) conforme cada agente termina e, por último,
+        ('final', resultado_consolidado). Consumidores interativos podem
+        exibir cada parcial assim que ele chega, em vez de esperar os 3
+        agentes (e os delays de API entre eles) para mostrar qualquer coisa.
+        """
+
         def log_status(mensagem: str):
             timestamp = datetime.now().strftime('%H:%M:%S')
             log_completo = f"{timestamp} - {mensagem}"
@@ -61,12 +79,14 @@ class OrquestradorAgentes:
             # Verificar se validador teve sucesso
             if resultado_validador.get('status') == 'erro':
                 log_status("Erro no Agente Validador - Abortando processamento")
-                return self._resultado_erro("Falha no Agente Validador", resultado_validador)
-            
+                yield ('final', self._resultado_erro("Falha no Agente Validador", resultado_validador))
+                return
+
             oportunidades = len(resultado_validador.get('oportunidades', []))
             discrepancias = len(resultado_validador.get('discrepancias', []))
             log_status(f"Validador concluído: {oportunidades} oportunidades, {discrepancias} discrepâncias encontradas")
-            
+            yield ('validador', resultado_validador)
+
             # AGENTE 2: ANALISTA (com delay para evitar limite de API)
             import time
             time.sleep(2)  # Delay de 2 segundos entre agentes
@@ -89,7 +109,9 @@ class OrquestradorAgentes:
             except Exception as e:
                 log_status(f"Erro no Agente Analista ({str(e)[:50]}...) - Continuando com Tributarista")
                 resultado_analista = {'status': 'erro', 'erro': str(e), 'solucoes_propostas': []}
-            
+
+            yield ('analista', resultado_analista)
+
             # AGENTE 3: TRIBUTARISTA (com delay para evitar limite de API)
             time.sleep(2)  # Delay de 2 segundos entre agentes
             
@@ -113,27 +135,29 @@ class OrquestradorAgentes:
             except Exception as e:
                 log_status(f"Erro no Agente Tributarista ({str(e)[:50]}...) - Processamento com limitações")
                 resultado_tributarista = {'status': 'erro', 'erro': str(e), 'analise_riscos': {}}
-            
+
+            yield ('tributarista', resultado_tributarista)
+
             # CONCLUSÃO
             log_status("Processamento concluído! Redirecionando para revisão...")
-            
-            return {
+
+            yield ('final', {
                 'status': 'sucesso',
                 'timestamp_processamento': datetime.now().isoformat(),
                 'validador': resultado_validador,
                 'analista': resultado_analista,
                 'tributarista': resultado_tributarista,
                 'resumo_execucao': self._gerar_resumo_execucao(
-                    resultado_validador, 
-                    resultado_analista, 
+                    resultado_validador,
+                    resultado_analista,
                     resultado_tributarista
                 )
-            }
-            
+            })
+
         except Exception as e:
             erro_msg = f"Erro crítico na orquestração: {str(e)}"
             log_status(erro_msg)
-            return self._resultado_erro("Erro crítico", {'erro': str(e)})
+            yield ('final', self._resultado_erro("Erro crítico", {'erro': str(e)}))
     
     def _extrair_delta_total(self, resultado_tributarista: Dict[str, Any]) -> str:
         """Extrai informação resumida do delta calculado"""
@@ -225,6 +249,20 @@ def processar_nfe_completa(cabecalho_df: pd.DataFrame,
     return orquestrador.processar_sequencial(cabecalho_df, produtos_df, callback_status)
 
 
+def processar_nfe_completa_stream(cabecalho_df: pd.DataFrame,
+                                  produtos_df: pd.DataFrame,
+                                  callback_status: Callable[[str], None] = None):
+    """
+    Variante streaming: gera (etapa, resultado) conforme cada agente termina
+
+    Produz ('validador', ...), ('analista', ...), ('tributarista', ...) e
+    por fim ('final', resultado_consolidado) — o mesmo dict que
+    processar_nfe_completa retorna.
+    """
+    orquestrador = OrquestradorAgentes()
+    yield from orquestrador.iterar_agentes(cabecalho_df, produtos_df, callback_status)
+
+
 if __name__ == "__main__":
     print("Orquestrador de Agentes - Sistema de Coordenação Fiscal")
     
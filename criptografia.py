@@ -43,7 +43,17 @@ class SecureDataProcessor:
             'operation_info': ['Natureza Operação', 'UF', 'Modelo', 'Série', 'Tipo NF', 'Finalidade'],
             'dates': ['Data Emissão', 'Data Saída/Entrada']
         }
-        
+
+        # Conjuntos achatados pré-computados: a classificação de colunas em
+        # encrypt_sensitive_data vira uma interseção com df.columns em vez
+        # de varrer as categorias a cada chamada
+        self._sensitive_column_set = frozenset(
+            field for fields in self.sensitive_fields.values() for field in fields
+        )
+        self._public_column_set = frozenset(
+            field for fields in self.public_fields.values() for field in fields
+        )
+
         # Gerar ou carregar chave de criptografia
         self.encryption_key = self._generate_or_load_key(master_password)
         self.cipher_suite = Fernet(self.encryption_key)
@@ -151,57 +161,55 @@ class SecureDataProcessor:
         encrypted_df = df.copy()
         self.encryption_stats['total_records'] = len(df)
         
-        # Identificar campos sensíveis presentes no DataFrame
-        sensitive_columns = []
-        for category, fields in self.sensitive_fields.items():
-            for field in fields:
-                if field in df.columns:
-                    sensitive_columns.append(field)
-        
-        # Identificar campos públicos (que não serão criptografados)
-        public_columns = []
-        for category, fields in self.public_fields.items():
-            for field in fields:
-                if field in df.columns:
-                    public_columns.append(field)
+        # Identificar campos sensíveis/públicos presentes no DataFrame via
+        # os conjuntos pré-computados no __init__ (ordem das colunas do df)
+        sensitive_columns = [col for col in df.columns if col in self._sensitive_column_set]
+        public_columns = [col for col in df.columns if col in self._public_column_set]
         
         logger.info(f"Campos sensíveis (serão criptografados): {sensitive_columns}")
         logger.info(f"Campos públicos (mantidos em texto claro): {public_columns}")
         
-        # Criptografar apenas campos sensíveis
+        # Criptografar apenas campos sensíveis. Cada valor distinto da
+        # coluna passa pelo pipeline (injection check, sanitização, AES,
+        # hash) uma única vez: em lotes com CNPJ/nome repetidos o número
+        # de chamadas de cifra cai de N linhas para U valores únicos
         for column in sensitive_columns:
             logger.info(f"Criptografando campo sensível: {column}")
             encrypted_values = []
             hashed_indexes = []
-            
+            cache = {}
+
             for index, value in df[column].items():
                 # Converter para string se necessário
                 str_value = str(value) if pd.notna(value) else ""
-                
-                # Detectar e bloquear injection attempts
-                if self._detect_injection_patterns(str_value):
-                    logger.error(f"Tentativa de injection bloqueada no campo {column}, registro {index}")
-                    str_value = "[BLOCKED_CONTENT]"
-                    self.encryption_stats['blocked_injections'] += 1
-                
-                # Sanitizar entrada
-                sanitized_value = self._sanitize_input(str_value)
-                
-                if sanitized_value and sanitized_value != "0":
-                    # Criptografar
-                    encrypted_value = self.cipher_suite.encrypt(sanitized_value.encode())
-                    encrypted_b64 = base64.b64encode(encrypted_value).decode()
-                    encrypted_values.append(f"ENC:{encrypted_b64}")
-                    
-                    # Criar hash para indexação
-                    hash_index = self._hash_for_indexing(sanitized_value)
-                    hashed_indexes.append(hash_index)
-                    
+
+                resultado = cache.get(str_value)
+                if resultado is None:
+                    # Detectar e bloquear injection attempts
+                    if self._detect_injection_patterns(str_value):
+                        logger.error(f"Tentativa de injection bloqueada no campo {column}, registro {index}")
+                        valor_seguro = "[BLOCKED_CONTENT]"
+                        self.encryption_stats['blocked_injections'] += 1
+                    else:
+                        valor_seguro = str_value
+
+                    # Sanitizar entrada
+                    sanitized_value = self._sanitize_input(valor_seguro)
+
+                    if sanitized_value and sanitized_value != "0":
+                        # Criptografar
+                        encrypted_value = self.cipher_suite.encrypt(sanitized_value.encode())
+                        encrypted_b64 = base64.b64encode(encrypted_value).decode()
+                        resultado = (f"ENC:{encrypted_b64}", self._hash_for_indexing(sanitized_value), True)
+                    else:
+                        resultado = (valor_seguro, "", False)
+                    cache[str_value] = resultado
+
+                encrypted_values.append(resultado[0])
+                hashed_indexes.append(resultado[1])
+                if resultado[2]:
                     self.encryption_stats['encrypted_fields'] += 1
-                else:
-                    encrypted_values.append(str_value)
-                    hashed_indexes.append("")
-            
+
             # Substituir valores originais por criptografados
             encrypted_df[column] = encrypted_values
             encrypted_df[f"{column}_hash"] = hashed_indexes
@@ -1,140 +1,532 @@
 import streamlit as st
-import pandas as pd
-import xml.etree.ElementTree as ET
+import sys
+import re
+import time
+import hashlib
+import functools
+from lxml import etree as LET
 from io import BytesIO
+from collections import deque
+import concurrent.futures
 import zipfile
-from criptografia import SecureDataProcessor
-from agents.orquestrador import processar_nfe_completa
 
+# pandas, criptografia e agents (langchain/google-generativeai na cadeia de
+# imports) são pesados: importados dentro das funções que os usam para não
+# atrasar o cold-start/rerun do Streamlit
 
-def extrair_dados_xml(xml_content):
-    ns = {"nfe": "http://www.portalfiscal.inf.br/nfe"}
-    root = ET.fromstring(xml_content)
-    infNFe = root.find(".//nfe:infNFe", ns)
-
-    def get_text(tag, parent=infNFe, default="0"):
-        return parent.findtext(tag, default=default, namespaces=ns)
-
-    dados = {}
-
-    # --- IDE (Identificação da Nota) ---
-    ide = infNFe.find("nfe:ide", ns)
-    if ide is not None:
-        dados["Número NF"] = get_text("nfe:nNF", ide)
-        dados["Série"] = get_text("nfe:serie", ide)
-        dados["Data Emissão"] = get_text("nfe:dhEmi", ide)
-        dados["Data Saída/Entrada"] = get_text("nfe:dhSaiEnt", ide)
-        dados["Natureza Operação"] = get_text("nfe:natOp", ide)
-        dados["Tipo NF"] = get_text("nfe:tpNF", ide)
-        dados["Modelo"] = get_text("nfe:mod", ide)
-        dados["UF"] = get_text("nfe:cUF", ide)
-        dados["Finalidade"] = get_text("nfe:finNFe", ide)
-
-    # --- EMITENTE ---
-    emit = infNFe.find("nfe:emit", ns)
-    if emit is not None:
-        dados["Emitente CNPJ"] = get_text("nfe:CNPJ", emit)
-        dados["Emitente Nome"] = get_text("nfe:xNome", emit)
-        dados["Emitente Fantasia"] = get_text("nfe:xFant", emit)
-        dados["Emitente IE"] = get_text("nfe:IE", emit)
-        dados["Emitente UF"] = get_text("nfe:enderEmit/nfe:UF", emit)
-        dados["Emitente Município"] = get_text("nfe:enderEmit/nfe:xMun", emit)
-        dados["Emitente CEP"] = get_text("nfe:enderEmit/nfe:CEP", emit)
-
-    # --- DESTINATÁRIO ---
-    dest = infNFe.find("nfe:dest", ns)
-    if dest is not None:
-        dados["Destinatário CNPJ"] = get_text("nfe:CNPJ", dest)
-        dados["Destinatário Nome"] = get_text("nfe:xNome", dest)
-        dados["Destinatário IE"] = get_text("nfe:IE", dest)
-        dados["Destinatário UF"] = get_text("nfe:enderDest/nfe:UF", dest)
-        dados["Destinatário Município"] = get_text("nfe:enderDest/nfe:xMun", dest)
-        dados["Destinatário CEP"] = get_text("nfe:enderDest/nfe:CEP", dest)
-
-    # --- TRANSPORTE ---
-    transp = infNFe.find("nfe:transp", ns)
-    if transp is not None:
-        transporta = transp.find("nfe:transporta", ns)
-        vol = transp.find("nfe:vol", ns)
-        dados["Modalidade Frete"] = get_text("nfe:modFrete", transp)
-        if transporta is not None:
-            dados["Transportadora Nome"] = get_text("nfe:xNome", transporta)
-            dados["Transportadora CNPJ"] = get_text("nfe:CNPJ", transporta)
-            dados["Transportadora UF"] = get_text("nfe:UF", transporta)
-        if vol is not None:
-            dados["Qtde Volumes"] = get_text("nfe:qVol", vol)
-            dados["Peso Líquido"] = get_text("nfe:pesoL", vol)
-            dados["Peso Bruto"] = get_text("nfe:pesoB", vol)
-
-    # --- COBRANÇA / FATURA ---
-    cobr = infNFe.find("nfe:cobr", ns)
-    if cobr is not None:
-        fat = cobr.find("nfe:fat", ns)
-        dup = cobr.find("nfe:dup", ns)
-        if fat is not None:
-            dados["Número Fatura"] = get_text("nfe:nFat", fat)
-            dados["Valor Original"] = get_text("nfe:vOrig", fat)
-            dados["Valor Líquido"] = get_text("nfe:vLiq", fat)
-        if dup is not None:
-            dados["Número Duplicata"] = get_text("nfe:nDup", dup)
-            dados["Data Vencimento"] = get_text("nfe:dVenc", dup)
-            dados["Valor Duplicata"] = get_text("nfe:vDup", dup)
-
-    # --- TOTALIZAÇÃO ---
-    total = infNFe.find(".//nfe:ICMSTot", ns)
-    if total is not None:
-        dados["Base ICMS"] = get_text("nfe:vBC", total)
-        dados["Valor ICMS"] = get_text("nfe:vICMS", total)
-        dados["Valor Produtos"] = get_text("nfe:vProd", total)
-        dados["Valor NF"] = get_text("nfe:vNF", total)
-        dados["Valor Frete"] = get_text("nfe:vFrete", total)
-        dados["Valor IPI"] = get_text("nfe:vIPI", total)
-        dados["Valor COFINS"] = get_text("nfe:vCOFINS", total)
-        dados["Valor PIS"] = get_text("nfe:vPIS", total)
-
-    # --- PRODUTOS ---
+# Namespace padrão da NF-e
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+
+def _tag(nome):
+    """Nome expandido (notação Clark) de uma tag da NF-e."""
+    return f"{{{NFE_NS}}}{nome}"
+
+
+# Seções da NF-e que interessam à extração (streaming por subárvore)
+_SECOES_NFE = tuple(
+    _tag(t) for t in ("ide", "emit", "dest", "transp", "cobr", "ICMSTot", "det")
+)
+
+# Tags pré-expandidas: find() sem namespaces= dispensa a resolução
+# "nfe:nome" -> "{uri}nome" a cada chamada
+_T_ENDER_EMIT = _tag("enderEmit")
+_T_ENDER_DEST = _tag("enderDest")
+_T_TRANSPORTA = _tag("transporta")
+_T_VOL = _tag("vol")
+_T_FAT = _tag("fat")
+_T_DUP = _tag("dup")
+
+def _children_text(parent):
+    """Coleta em uma única passada o texto dos filhos diretos de uma seção.
+
+    Retorna um dict {nome_local: texto}, evitando uma busca XPath por campo.
+    iterchildren('*') pula comentários/PIs, cujo .tag não é string.
+    """
+    return {
+        el.tag.rpartition("}")[2]: (el.text or "0")
+        for el in parent.iterchildren("*")
+    }
+
+
+# Esquema fixo do cabeçalho: colunas na ordem das seções da NF-e.
+# sys.intern compartilha as strings de nome de coluna entre todas as
+# notas processadas no mesmo processo
+CABEC_COLS = tuple(sys.intern(s) for s in (
+    "Número NF", "Série", "Data Emissão", "Data Saída/Entrada",
+    "Natureza Operação", "Tipo NF", "Modelo", "UF", "Finalidade",
+    "Emitente CNPJ", "Emitente Nome", "Emitente Fantasia", "Emitente IE",
+    "Emitente UF", "Emitente Município", "Emitente CEP",
+    "Destinatário CNPJ", "Destinatário Nome", "Destinatário IE",
+    "Destinatário UF", "Destinatário Município", "Destinatário CEP",
+    "Base ICMS", "Valor ICMS", "Valor Produtos", "Valor NF", "Valor Frete",
+    "Valor IPI", "Valor COFINS", "Valor PIS",
+    "Modalidade Frete", "Transportadora Nome", "Transportadora CNPJ",
+    "Transportadora UF", "Qtde Volumes", "Peso Líquido", "Peso Bruto",
+    "Número Fatura", "Valor Original", "Valor Líquido",
+    "Número Duplicata", "Data Vencimento", "Valor Duplicata",
+))
+
+# Esquema fixo dos produtos: colunas em ordem posicional
+PROD_COLS = tuple(sys.intern(s) for s in (
+    "Item", "Código", "Descrição", "NCM", "CFOP", "Unidade", "Quantidade",
+    "Valor Unitário", "Valor Total", "ICMS", "IPI", "PIS", "COFINS",
+))
+
+# Colunas numéricas dos produtos: dtype float reduz memória frente a strings
+# em colunas object e habilita agregações vetorizadas nos consumidores.
+# float64 (não float32) porque são valores monetários e 39.60 deve continuar
+# exibindo como 39.60
+PROD_NUMERIC = (
+    "Quantidade", "Valor Unitário", "Valor Total", "ICMS", "IPI", "PIS", "COFINS",
+)
+
+# Dtypes finais do frame de produtos: float64 nos valores, string dedicada
+# (em vez de object) no restante — menor e mais rápido em filtro/groupby
+PROD_DTYPES = {
+    c: ("float64" if c in PROD_NUMERIC else "string") for c in PROD_COLS
+}
+
+# "Plano de extração" especializado por seção: pares (rótulo, tag local)
+# percorridos em loop apertado sobre o dict de filhos. Especializar por
+# índice de filho (codegen via exec) foi descartado: o schema da NF-e tem
+# elementos opcionais, então as posições variam entre notas
+_IDE_FIELDS = (
+    ("Número NF", "nNF"), ("Série", "serie"), ("Data Emissão", "dhEmi"),
+    ("Data Saída/Entrada", "dhSaiEnt"), ("Natureza Operação", "natOp"),
+    ("Tipo NF", "tpNF"), ("Modelo", "mod"), ("UF", "cUF"),
+    ("Finalidade", "finNFe"),
+)
+_EMIT_FIELDS = (
+    ("Emitente CNPJ", "CNPJ"), ("Emitente Nome", "xNome"),
+    ("Emitente Fantasia", "xFant"), ("Emitente IE", "IE"),
+)
+_ENDER_EMIT_FIELDS = (
+    ("Emitente UF", "UF"), ("Emitente Município", "xMun"),
+    ("Emitente CEP", "CEP"),
+)
+_DEST_FIELDS = (
+    ("Destinatário CNPJ", "CNPJ"), ("Destinatário Nome", "xNome"),
+    ("Destinatário IE", "IE"),
+)
+_ENDER_DEST_FIELDS = (
+    ("Destinatário UF", "UF"), ("Destinatário Município", "xMun"),
+    ("Destinatário CEP", "CEP"),
+)
+_TRANSP_FIELDS = (("Modalidade Frete", "modFrete"),)
+_TRANSPORTA_FIELDS = (
+    ("Transportadora Nome", "xNome"), ("Transportadora CNPJ", "CNPJ"),
+    ("Transportadora UF", "UF"),
+)
+_VOL_FIELDS = (
+    ("Qtde Volumes", "qVol"), ("Peso Líquido", "pesoL"),
+    ("Peso Bruto", "pesoB"),
+)
+_FAT_FIELDS = (
+    ("Número Fatura", "nFat"), ("Valor Original", "vOrig"),
+    ("Valor Líquido", "vLiq"),
+)
+_DUP_FIELDS = (
+    ("Número Duplicata", "nDup"), ("Data Vencimento", "dVenc"),
+    ("Valor Duplicata", "vDup"),
+)
+_ICMSTOT_FIELDS = (
+    ("Base ICMS", "vBC"), ("Valor ICMS", "vICMS"),
+    ("Valor Produtos", "vProd"), ("Valor NF", "vNF"),
+    ("Valor Frete", "vFrete"), ("Valor IPI", "vIPI"),
+    ("Valor COFINS", "vCOFINS"), ("Valor PIS", "vPIS"),
+)
+
+
+def _preencher(dados, vals, campos):
+    """Aplica um plano de extração (rótulo, tag local) sobre os filhos lidos."""
+    get = vals.get
+    for label, lname in campos:
+        v = get(lname)
+        if v is not None:
+            dados[label] = v
+
+
+# --- Handlers por seção: recebem o elemento da seção e escrevem em dados ---
+
+def _sec_ide(elem, dados):
+    _preencher(dados, _children_text(elem), _IDE_FIELDS)
+
+
+def _sec_emit(elem, dados):
+    _preencher(dados, _children_text(elem), _EMIT_FIELDS)
+    ender = elem.find(_T_ENDER_EMIT)
+    if ender is not None:
+        _preencher(dados, _children_text(ender), _ENDER_EMIT_FIELDS)
+
+
+def _sec_dest(elem, dados):
+    _preencher(dados, _children_text(elem), _DEST_FIELDS)
+    ender = elem.find(_T_ENDER_DEST)
+    if ender is not None:
+        _preencher(dados, _children_text(ender), _ENDER_DEST_FIELDS)
+
+
+def _sec_transp(elem, dados):
+    _preencher(dados, _children_text(elem), _TRANSP_FIELDS)
+    transporta = elem.find(_T_TRANSPORTA)
+    vol = elem.find(_T_VOL)
+    if transporta is not None:
+        _preencher(dados, _children_text(transporta), _TRANSPORTA_FIELDS)
+    if vol is not None:
+        _preencher(dados, _children_text(vol), _VOL_FIELDS)
+
+
+def _sec_cobr(elem, dados):
+    fat = elem.find(_T_FAT)
+    dup = elem.find(_T_DUP)
+    if fat is not None:
+        _preencher(dados, _children_text(fat), _FAT_FIELDS)
+    if dup is not None:
+        _preencher(dados, _children_text(dup), _DUP_FIELDS)
+
+
+def _sec_icmstot(elem, dados):
+    _preencher(dados, _children_text(elem), _ICMSTOT_FIELDS)
+
+
+# Despacho por nome local: um único dict lookup por seção no lugar da
+# cadeia if/elif (det tem tratamento próprio por alimentar produtos)
+_SEC_HANDLERS = {
+    "ide": _sec_ide,
+    "emit": _sec_emit,
+    "dest": _sec_dest,
+    "transp": _sec_transp,
+    "cobr": _sec_cobr,
+    "ICMSTot": _sec_icmstot,
+}
+
+
+# Campos coletados do det em uma única descida (prod + impostos aninhados)
+_DET_CAMPOS = frozenset({
+    "cProd", "xProd", "NCM", "CFOP", "uCom", "qCom", "vUnCom", "vProd",
+    "vICMS", "vIPI", "vPIS", "vCOFINS",
+})
+
+
+def extrair_dados_xml_raw(xml_content):
+    """Extrai uma NF-e sem construir DataFrames (núcleo livre de pandas).
+
+    Percorre o XML com lxml.etree.iterparse capturando apenas as subárvores
+    de interesse e liberando cada uma após o uso (elem.clear() + remoção dos
+    irmãos anteriores), então o consumo de memória fica proporcional à maior
+    seção, não ao documento inteiro. Retorna (dados, produtos): o dict do
+    cabeçalho e a lista de tuplas na ordem de PROD_COLS — pipelines em lote
+    devem acumular esses resultados e montar um único DataFrame no final.
+
+    Aceita bytes, str ou um objeto file-like (ex.: UploadedFile): streams
+    são lidos incrementalmente pelo iterparse, sem materializar o payload.
+    """
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode("utf-8")
+    if isinstance(xml_content, bytes):
+        fonte = BytesIO(xml_content)
+    else:
+        # File-like: o iterparse consome o stream em blocos
+        if hasattr(xml_content, "seek"):
+            xml_content.seek(0)
+        fonte = xml_content
+
+    # Chaves pré-internadas e já inicializadas com o sentinela "0": seções
+    # ausentes não precisam de tratamento posterior
+    dados = dict.fromkeys(CABEC_COLS, "0")
     produtos = []
-    for det in infNFe.findall("nfe:det", ns):
-        prod = det.find("nfe:prod", ns)
-        imp = det.find("nfe:imposto", ns)
-        if prod is not None:
-            p = {
-                "Item": det.attrib.get("nItem", "0"),
-                "Código": get_text("nfe:cProd", prod),
-                "Descrição": get_text("nfe:xProd", prod),
-                "NCM": get_text("nfe:NCM", prod),
-                "CFOP": get_text("nfe:CFOP", prod),
-                "Unidade": get_text("nfe:uCom", prod),
-                "Quantidade": get_text("nfe:qCom", prod),
-                "Valor Unitário": get_text("nfe:vUnCom", prod),
-                "Valor Total": get_text("nfe:vProd", prod),
-            }
-            if imp is not None:
-                p["ICMS"] = get_text(".//nfe:vICMS", imp)
-                p["IPI"] = get_text(".//nfe:vIPI", imp)
-                p["PIS"] = get_text(".//nfe:vPIS", imp)
-                p["COFINS"] = get_text(".//nfe:vCOFINS", imp)
-            produtos.append(p)
-
-    produtos_df = pd.DataFrame(produtos).fillna("0")
-    cabecalho_df = pd.DataFrame([dados]).fillna("0")
+    # Binding local: evita o lookup de global por det no caminho quente
+    campos_det = _DET_CAMPOS
+
+    handlers = _SEC_HANDLERS
+    context = LET.iterparse(fonte, events=("end",), tag=_SECOES_NFE)
+    for _, elem in context:
+        secao = elem.tag.rsplit("}", 1)[1]
+        handler = handlers.get(secao)
+
+        # --- Seções do cabeçalho (ide/emit/dest/transp/cobr/ICMSTot) ---
+        if handler is not None:
+            handler(elem, dados)
+
+        # --- PRODUTOS ---
+        else:
+            # Uma única descida pela subárvore do det substitui os finds em
+            # prod e as quatro buscas descendentes (.//) em imposto.
+            # iter('*') pula comentários/PIs (cujo .tag não é string)
+            texts = {}
+            setdefault = texts.setdefault
+            tem_prod = False
+            for el in elem.iter("*"):
+                lname = el.tag.rpartition("}")[2]
+                if lname == "prod":
+                    tem_prod = True
+                elif lname in campos_det:
+                    setdefault(lname, el.text or "0")
+            # Linha só existe se o det tem um prod, como no comportamento
+            # original — um det apenas com imposto não gera produto fantasma
+            if tem_prod:
+                # Tupla na ordem de PROD_COLS; "0" já é emitido na extração,
+                # dispensando o fillna no DataFrame
+                produtos.append((
+                    elem.attrib.get("nItem", "0"),
+                    texts.get("cProd", "0"),
+                    texts.get("xProd", "0"),
+                    texts.get("NCM", "0"),
+                    texts.get("CFOP", "0"),
+                    texts.get("uCom", "0"),
+                    texts.get("qCom", "0"),
+                    texts.get("vUnCom", "0"),
+                    texts.get("vProd", "0"),
+                    texts.get("vICMS", "0"),
+                    texts.get("vIPI", "0"),
+                    texts.get("vPIS", "0"),
+                    texts.get("vCOFINS", "0"),
+                ))
+
+        # Libera a subárvore já processada e os irmãos anteriores
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return dados, produtos
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def extrair_dados_xml(xml_content):
+    """Extrai cabeçalho e produtos da NF-e como DataFrames.
+
+    Cacheada por conteúdo (st.cache_data): reruns do Streamlit com o mesmo
+    arquivo reaproveitam os DataFrames já extraídos em vez de re-parsear.
+    """
+    import pandas as pd
+
+    dados, produtos = extrair_dados_xml_raw(xml_content)
+
+    produtos_df = pd.DataFrame.from_records(
+        produtos, columns=PROD_COLS
+    ).astype(PROD_DTYPES)
+    # Construtor coluna-orientado (dict de listas): evita o caminho lento de
+    # lista-de-dicts e o fillna posterior — campos ausentes já saem como "0".
+    # dtype=string explícito: todos os valores já são str, então o frame
+    # nasce com dtype dedicado em vez de object
+    cabecalho_df = pd.DataFrame(
+        {c: [dados[c]] for c in CABEC_COLS}, columns=CABEC_COLS, dtype="string"
+    )
 
     return cabecalho_df, produtos_df
 
-def exibir_relatorio_tributario(relatorio):
-    import re
-    # Remove emojis
-    relatorio = relatorio.replace("🧮", "").replace("🔢", "").replace("🚨", "").replace("🏭", "")
+def extrair_varios(xml_contents):
+    """Extrai várias NF-es em paralelo e consolida em dois DataFrames.
+
+    O lxml libera o GIL durante o parse em C, então um ThreadPoolExecutor
+    aproxima speedup linear na etapa de parse quando o usuário envia N
+    arquivos. O parse paralelo usa o núcleo livre de pandas e a construção
+    de DataFrame acontece uma única vez na fronteira do lote — N construções
+    de frame de 1 linha + concat é o caminho lento. Retorna
+    (cabecalhos_df, produtos_df): uma linha de cabeçalho por arquivo, na
+    ordem da entrada, e todos os produtos encadeados.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(8, max(1, len(xml_contents)))
+    ) as ex:
+        resultados = list(ex.map(extrair_dados_xml_raw, xml_contents))
+
+    return _consolidar_lote(resultados)
+
+
+def _consolidar_lote(resultados):
+    """Consolida [(dados, produtos), ...] em dois DataFrames, uma alocação só."""
+    import itertools
+    import pandas as pd
+
+    cabecalhos_df = pd.DataFrame(
+        [d for d, _ in resultados], columns=CABEC_COLS, dtype="string"
+    )
+    produtos_df = pd.DataFrame.from_records(
+        itertools.chain.from_iterable(p for _, p in resultados),
+        columns=PROD_COLS,
+    ).astype(PROD_DTYPES)
+    return cabecalhos_df, produtos_df
+
+
+def extrair_zip(zip_bytes):
+    """Extrai todas as NF-es de um ZIP em streaming e consolida os frames.
 
-    # Fix bold syntax and remove extra spaces
-    relatorio = re.sub(r'\*\*\s*(.*?)\s*:\*\*', r'**\1:**', relatorio)
+    Cada membro .xml é aberto como stream (zf.open) e alimentado direto no
+    iterparse, sem .read() do arquivo inteiro: o pico de memória fica em
+    O(um det) por arquivo em vez de O(documento), e o ZIP descompacta por
+    blocos durante o próprio parse.
+    """
+    resultados = []
+    with zipfile.ZipFile(BytesIO(zip_bytes)) as zf:
+        for nome in zf.namelist():
+            if not nome.lower().endswith('.xml'):
+                continue
+            with zf.open(nome) as fp:
+                resultados.append(extrair_dados_xml_raw(fp))
+
+    return _consolidar_lote(resultados)
+
+
+# Limpeza do relatório tributário, compilada uma vez no import: os quatro
+# emojis caem em um único sub de classe de caracteres, e o ajuste de
+# negrito reusa o pattern compilado em vez de passar pelo cache do re
+_EMOJI_RE = re.compile("[🧮🔢🚨🏭]")
+_NEGRITO_RE = re.compile(r'\*\*\s*(.*?)\s*:\*\*')
+
+
+def exibir_relatorio_tributario(relatorio):
+    # Remove emojis e corrige o negrito em duas passadas únicas
+    relatorio = _EMOJI_RE.sub("", relatorio)
+    relatorio = _NEGRITO_RE.sub(r'**\1:**', relatorio)
 
     st.markdown(relatorio, unsafe_allow_html=True)
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def _logs_para_download(df_logs, fmt):
+    """Converte o grid de logs em bytes para download ('csv' ou 'xlsx').
+
+    Cacheada pelo conteúdo: sem cache esse custo era pago em todo rerun
+    do expander, mesmo sem clique no botão. O CSV é escrito direto em
+    BytesIO em vez de materializar uma str intermediária que o Streamlit
+    re-codificaria; no Excel, constant_memory faz o xlsxwriter escrever
+    as linhas em streaming em vez de bufferizar a planilha inteira.
+    """
+    import pandas as pd
+
+    buffer_logs = BytesIO()
+    if fmt == 'csv':
+        try:
+            # Escritor CSV do pyarrow: single-pass e em C, bem mais rápido
+            # que o writer Python do pandas para o grid de logs
+            import pyarrow as pa
+            import pyarrow.csv as pacsv
+
+            pacsv.write_csv(
+                pa.Table.from_pandas(df_logs, preserve_index=False), buffer_logs
+            )
+        except ImportError:
+            df_logs.to_csv(buffer_logs, index=False, encoding='utf-8')
+    else:
+        with pd.ExcelWriter(
+            buffer_logs, engine='xlsxwriter',
+            engine_kwargs={"options": {"constant_memory": True}},
+        ) as writer:
+            df_logs.to_excel(writer, sheet_name='Logs_Processamento', index=False)
+    return buffer_logs.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_and_encrypt(_xml_bytes, file_key):
+    """Parse + criptografia como função pura dos bytes do arquivo.
+
+    Cacheada pelo file_key (o underscore faz o Streamlit não re-hashear
+    os bytes do XML a cada rerun): troca de aba, filtro ou clique de
+    botão com o mesmo upload reutiliza os quatro DataFrames em vez de
+    re-parsear e re-criptografar. Também estabiliza a saída — o Fernet
+    gera IV aleatório, então sem cache cada rerun exibiria criptogramas
+    diferentes para o mesmo arquivo.
+    """
+    from criptografia import SecureDataProcessor
+
+    cabecalho_df, produtos_df = extrair_dados_xml(_xml_bytes)
+    processor = SecureDataProcessor()
+    cabecalho_criptografado = processor.encrypt_sensitive_data(cabecalho_df)
+    produtos_criptografado = processor.encrypt_sensitive_data(produtos_df)
+    return cabecalho_df, produtos_df, cabecalho_criptografado, produtos_criptografado
+
+
+# Colunas do grid de logs; as entradas são tuplas nesta ordem
+_LOG_COLS = ("Timestamp", "Agente", "Status", "Mensagem")
+
+# Pool pequeno para gerar o PDF em paralelo com a renderização da UI
+_PDF_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _logs_historico_df(entradas):
+    """DataFrame do histórico de logs, cacheado pelo conteúdo das entradas.
+
+    Recebe as tuplas do deque (no máximo 50) como argumento: o cache do
+    st.cache_data é global entre sessões, então a chave precisa ser o
+    conteúdo — o comprimento não basta (o deque rotaciona no maxlen e
+    outra sessão pode ter a mesma contagem). Hashear ≤50 tuplas curtas é
+    barato e ainda evita reconstruir o frame a cada troca de filtro.
+    """
+    import pandas as pd
+
+    # Dtypes explícitos: pula a inferência por coluna, e category
+    # transforma os filtros de Agente/Status em comparação de códigos
+    # int8 em vez de strings Python
+    return pd.DataFrame.from_records(
+        list(entradas), columns=_LOG_COLS
+    ).astype({
+        "Timestamp": "string",
+        "Agente": "category",
+        "Status": "category",
+        "Mensagem": "string",
+    })
+
+
+# Classe de cada palavra-chave, em ordem de precedência:
+# (agente, status, progresso, rótulo da barra, finalizado)
+_MSG_CLASSES = {
+    "validador": ("Validador", "Processando", 33, "Executando Validador...", False),
+    "analista": ("Analista", "Processando", 66, "Executando Analista...", False),
+    "tributarista": ("Tributarista", "Processando", 100, "Executando Tributarista...", False),
+    "finalizado": ("Sistema", "✅ Concluído", 100, "✅ Processamento Concluído!", True),
+    # "concluído" e "erro" também forçam flush: a mensagem terminal real do
+    # orquestrador ("Processamento concluído!...") cai aqui, e sem o flag o
+    # debounce engoliria a última atualização do grid/da barra
+    "concluído": ("Sistema", "✅ Concluído", 0, "Iniciando...", True),
+    "erro": ("Sistema", "❌ Erro", 0, "Iniciando...", True),
+}
+_MSG_DEFAULT = ("Sistema", "Info", 0, "Iniciando...", False)
+# Alternação única: todas as palavras-chave são buscadas em uma só
+# varredura da mensagem, em vez de um scan por palavra
+_MSG_RE = re.compile("|".join(_MSG_CLASSES))
+
+
+def _classificar_mensagem(mensagem):
+    """Classifica uma mensagem de status dos agentes em uma única passada.
+
+    Retorna (agente, status, progresso, status_atual, finalizado). Sem
+    memoização: cada mensagem chega prefixada com um timestamp HH:MM:SS
+    único do log_status do orquestrador, então um cache nunca acertaria —
+    só reteria strings mortas.
+    """
+    encontradas = {m.group() for m in _MSG_RE.finditer(mensagem.lower())}
+    if encontradas:
+        for chave, classe in _MSG_CLASSES.items():
+            if chave in encontradas:
+                return classe
+    return _MSG_DEFAULT
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cabecalho_view(cabecalho_df):
+    """Visão Campo/Valor do cabeçalho para exibição.
+
+    Substitui o cabecalho_df.T a cada rerun: o transpose sobe todos os
+    dtypes para object e reconstrói o frame, enquanto esta visão de duas
+    colunas de string é construída uma vez e serializa para Arrow em um
+    buffer contíguo.
+    """
+    import pandas as pd
+
+    return pd.DataFrame({
+        "Campo": cabecalho_df.columns,
+        "Valor": cabecalho_df.iloc[0].astype(str).values,
+    })
+
+
 # ==============================
 # STREAMLIT INTERFACE
 # ==============================
 def main_screen():
+    import pandas as pd
+
     st.set_page_config(layout="wide")
     st.markdown("""
     <style>
@@ -172,19 +564,28 @@ def main_screen():
 
     if uploaded_file is not None:
         st.subheader("Passo 2: Analise os dados")
-        xml_content = uploaded_file.read().decode("utf-8")
+        # Bytes crus do upload: o parser detecta o encoding pela declaração
+        # XML, sem o round-trip decode/encode de uma string intermediária
+        xml_content = uploaded_file.getvalue()
+
+        # Identidade do upload pelo conteúdo, não pelo nome: mesmo arquivo
+        # renomeado reaproveita parse/agentes; nome igual com conteúdo novo
+        # não. blake2b é o hash mais rápido da stdlib para payloads grandes.
+        # O file_id do Streamlit identifica o mesmo upload entre reruns,
+        # então o payload só é re-hasheado quando há arquivo novo de fato.
+        if st.session_state.get('_upload_id') == uploaded_file.file_id:
+            file_key = st.session_state.file_key
+        else:
+            file_key = hashlib.blake2b(xml_content, digest_size=16).hexdigest()
+            st.session_state._upload_id = uploaded_file.file_id
+            st.session_state.file_key = file_key
+
+        # Extração + criptografia cacheadas pelo file_key: reruns sem novo
+        # upload não pagam parse, AES nem o re-hash dos bytes do XML
+        (cabecalho_df, produtos_df,
+         cabecalho_criptografado, produtos_criptografado) = _parse_and_encrypt(xml_content, file_key)
 
-        cabecalho_df, produtos_df = extrair_dados_xml(xml_content)
 
-        # Criptografar dados automaticamente
-        processor = SecureDataProcessor()
-        
-        # Criptografar cabecalho
-        cabecalho_criptografado = processor.encrypt_sensitive_data(cabecalho_df)
-        
-        # Criptografar produtos  
-        produtos_criptografado = processor.encrypt_sensitive_data(produtos_df)
-        
         # Salvar dados na sessão para edição imediata
         st.session_state.cabecalho_df = cabecalho_criptografado
         st.session_state.produtos_df = produtos_criptografado
@@ -196,28 +597,36 @@ def main_screen():
         with tab1:
             # Manter expandables normais + adicionar dropdown criptografado
             with st.expander("Dados Gerais da NF-e", expanded=True):
-                st.dataframe(cabecalho_df.T, use_container_width=True)
+                st.dataframe(
+                    _cabecalho_view(cabecalho_df),
+                    use_container_width=True,
+                    height=400,
+                    hide_index=True
+                )
 
             with st.expander("Produtos e Impostos Detalhados", expanded=False):
                 st.dataframe(produtos_df, use_container_width=True)
 
             # NOVO - Dropdown para dados criptografados
             with st.expander("Dados Criptografados", expanded=False):
-                tab_c1, tab_c2 = st.tabs(["Cabeçalho", "Produtos"])
-                
-                with tab_c1:
-                    st.dataframe(cabecalho_criptografado, use_container_width=True)
-                
-                with tab_c2:
-                    st.dataframe(produtos_criptografado, use_container_width=True)
+                # Expander colapsado ainda serializa os DataFrames para
+                # Arrow a cada rerun; só renderiza os grids sob demanda
+                if st.checkbox("Mostrar dados criptografados", value=False, key="show_crypto"):
+                    tab_c1, tab_c2 = st.tabs(["Cabeçalho", "Produtos"])
+
+                    with tab_c1:
+                        st.dataframe(cabecalho_criptografado, use_container_width=True)
+
+                    with tab_c2:
+                        st.dataframe(produtos_criptografado, use_container_width=True)
         
         with tab2:
             # Análise Fiscal com IA
             st.subheader("Busca de Regras Fiscais")
             
             # Verificar se já existe um resultado processado na sessão
-            if (st.session_state.get('agentes_processados') and 
-                st.session_state.get('arquivo_xml_nome') == uploaded_file.name):
+            if (st.session_state.get('agentes_processados') and
+                st.session_state.get('agentes_file_key') == file_key):
                 st.info("Resultados anteriores carregados da sessão")
                 pdf_data_from_agents, pdf_file_name_from_agents = exibir_resultados_processamento()
                 if pdf_data_from_agents and pdf_file_name_from_agents:
@@ -243,98 +652,95 @@ def main_screen():
                         progress_bar = st.progress(0)
                         status_placeholder = st.empty()
                     
-                    # Lista para capturar logs estruturados
+                    # Deque limitado para capturar logs estruturados:
+                    # inserção O(1) e descarte automático dos mais antigos
                     if 'log_processamento' not in st.session_state:
-                        st.session_state.log_processamento = []
+                        st.session_state.log_processamento = deque(maxlen=50)
                     
                     def callback_status(mensagem):
                         import datetime
                         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-                        
-                        # Determinar o agente e status da mensagem
-                        agente = "Sistema"
-                        status = "Info"
-                        
-                        if "Validador" in mensagem:
-                            agente = "Validador"
-                            status = "Processando"
-                        elif "Analista" in mensagem:
-                            agente = "Analista"
-                            status = "Processando"
-                        elif "Tributarista" in mensagem:
-                            agente = "Tributarista"
-                            status = "Processando"
-                        elif "finalizado" in mensagem.lower() or "concluído" in mensagem.lower():
-                            status = "✅ Concluído"
-                        elif "erro" in mensagem.lower():
-                            status = "❌ Erro"
-                        
-                        # Adicionar log estruturado
-                        log_entry = {
-                            "Timestamp": timestamp,
-                            "Agente": agente,
-                            "Status": status,
-                            "Mensagem": mensagem
-                        }
-                        st.session_state.log_processamento.append(log_entry)
-                        
-                        # Criar DataFrame dos logs
-                        df_logs = pd.DataFrame(st.session_state.log_processamento)
-                        
-                        # Exibir grid com rolagem
-                        with log_placeholder.container():
-                            st.dataframe(
-                                df_logs,
-                                use_container_width=True,
-                                height=300,  # Altura fixa com rolagem
-                                column_config={
-                                    "Timestamp": st.column_config.TextColumn("Tempo", width="small"),
-                                    "Agente": st.column_config.TextColumn("Agente", width="medium"),
-                                    "Status": st.column_config.TextColumn("Status", width="medium"),
-                                    "Mensagem": st.column_config.TextColumn("Detalhes", width="large")
-                                },
-                                hide_index=True
+
+                        # Agente, status e progresso resolvidos em uma única
+                        # passada (cacheada) sobre a mensagem
+                        (agente, status, progresso,
+                         status_atual, finalizado) = _classificar_mensagem(mensagem)
+
+                        # Adicionar log estruturado (tupla na ordem de _LOG_COLS)
+                        st.session_state.log_processamento.append(
+                            (timestamp, agente, status, mensagem)
+                        )
+
+                        # Reconstruir e re-renderizar o grid inteiro a cada
+                        # mensagem é O(n²) no total; agrupa as atualizações em
+                        # um orçamento de tempo (ou a cada 5 mensagens) para
+                        # manter o custo linear
+                        agora = time.monotonic()
+                        pendentes = st.session_state.get('_log_pendentes', 0) + 1
+                        renderizar = (
+                            agora - st.session_state.get('_log_render_ts', 0.0) > 0.25
+                            or pendentes >= 5
+                            or finalizado
+                        )
+                        if not renderizar:
+                            st.session_state._log_pendentes = pendentes
+                        else:
+                            st.session_state._log_render_ts = agora
+                            st.session_state._log_pendentes = 0
+
+                            # Criar DataFrame dos logs
+                            df_logs = pd.DataFrame.from_records(
+                                list(st.session_state.log_processamento),
+                                columns=_LOG_COLS
                             )
-                        
-                        # Atualizar barra de progresso e status
-                        progresso = 0
-                        status_atual = "Iniciando..."
-                        
-                        if "Validador" in mensagem:
-                            progresso = 33
-                            status_atual = "Executando Validador..."
-                        elif "Analista" in mensagem:
-                            progresso = 66
-                            status_atual = "Executando Analista..."
-                        elif "Tributarista" in mensagem:
-                            progresso = 100
-                            status_atual = "Executando Tributarista..."
-                        elif "finalizado" in mensagem.lower():
-                            progresso = 100
-                            status_atual = "✅ Processamento Concluído!"
-                        
-                        progress_bar.progress(progresso)
-                        status_placeholder.info(f"**Status:** {status_atual}")
-                        
-                        # Scroll automático para o último log (simular)
-                        if len(st.session_state.log_processamento) > 10:
-                            # Manter apenas os últimos 50 logs para performance
-                            st.session_state.log_processamento = st.session_state.log_processamento[-50:]
-                    
+
+                            # Exibir grid com rolagem
+                            with log_placeholder.container():
+                                st.dataframe(
+                                    df_logs,
+                                    use_container_width=True,
+                                    height=300,  # Altura fixa com rolagem
+                                    column_config={
+                                        "Timestamp": st.column_config.TextColumn("Tempo", width="small"),
+                                        "Agente": st.column_config.TextColumn("Agente", width="medium"),
+                                        "Status": st.column_config.TextColumn("Status", width="medium"),
+                                        "Mensagem": st.column_config.TextColumn("Detalhes", width="large")
+                                    },
+                                    hide_index=True
+                                )
+
+                            # Barra de progresso e status compartilham o
+                            # mesmo orçamento do grid: um frame websocket
+                            # por lote, com flush garantido no "finalizado"
+                            progress_bar.progress(progresso)
+                            status_placeholder.info(f"**Status:** {status_atual}")
+
                     try:
-                        # Executar orquestração dos 3 agentes
-                        resultado_completo = processar_nfe_completa(
+                        # Import adiado: só paga o custo do langchain quando
+                        # o usuário dispara os agentes
+                        from agents.orquestrador import processar_nfe_completa_stream
+
+                        # Executar orquestração dos 3 agentes em streaming:
+                        # cada parcial entra no session_state assim que o
+                        # agente termina, sem esperar a cadeia inteira
+                        resultado_completo = None
+                        for etapa, parcial in processar_nfe_completa_stream(
                             cabecalho_criptografado,
                             produtos_criptografado,
                             callback_status
-                        )
-                        
+                        ):
+                            if etapa == 'final':
+                                resultado_completo = parcial
+                            else:
+                                st.session_state[f'resultado_{etapa}'] = parcial
+
                         # Armazenar resultados na sessão e em arquivo temporário
                         st.session_state.resultado_validador = resultado_completo.get('validador', {})
                         st.session_state.resultado_analista = resultado_completo.get('analista', {})
                         st.session_state.resultado_tributarista = resultado_completo.get('tributarista', {})
                         st.session_state.resumo_execucao = resultado_completo.get('resumo_execucao', {})
                         st.session_state.agentes_processados = True
+                        st.session_state.agentes_file_key = file_key
                         st.session_state.timestamp_processamento = resultado_completo.get('timestamp_processamento')
                         
                         # Salvar em arquivo temporário para persistência
@@ -342,7 +748,8 @@ def main_screen():
                             cabecalho_criptografado, 
                             produtos_criptografado, 
                             resultado_completo,
-                            uploaded_file.name
+                            uploaded_file.name,
+                            file_key
                         )
                         
                         if resultado_completo['status'] == 'sucesso':
@@ -384,6 +791,8 @@ def main_screen():
 
 def exibir_resultados_processamento():
     """Exibe os resultados do processamento dos agentes a partir do session_state"""
+    import pandas as pd
+
     try:
         # Recuperar dados do session_state
         resultado_validador = st.session_state.get('resultado_validador', {})
@@ -403,13 +812,26 @@ def exibir_resultados_processamento():
             'timestamp_processamento': timestamp_proc
         }
         
+        # Reaproveita o PDF já gerado nesta sessão quando os resultados não
+        # mudaram (mesmo arquivo + mesmo timestamp de processamento): reruns
+        # de scroll/filtro não pagam outro build completo do ReportLab
+        pdf_cache_key = (arquivo_nome, timestamp_proc)
+        if (st.session_state.get('pdf_cache_key') == pdf_cache_key
+                and st.session_state.get('pdf_data_report')):
+            pdf_future = None
+        else:
+            # Dispara a geração do PDF já no início: o ReportLab trabalha na
+            # thread do pool enquanto o restante da função renderiza a UI, e o
+            # resultado é coletado lá embaixo, no ponto do botão de download
+            pdf_future = _PDF_EXECUTOR.submit(gerar_relatorio_pdf, resultado_completo, arquivo_nome)
+
         # Exibir resumo executivo
         st.success("Processamento concluído com sucesso!")
-        
+
         # Seção do histórico de logs
         with st.expander("Histórico de Processamento", expanded=False):
             if 'log_processamento' in st.session_state and st.session_state.log_processamento:
-                df_logs_historico = pd.DataFrame(st.session_state.log_processamento)
+                df_logs_historico = _logs_historico_df(tuple(st.session_state.log_processamento))
                 
                 # Filtros para o histórico
                 col_filtro1, col_filtro2 = st.columns(2)
@@ -422,16 +844,25 @@ def exibir_resultados_processamento():
                     status_disponiveis = ["Todos"] + df_logs_historico["Status"].unique().tolist()
                     filtro_status = st.selectbox("Filtrar por Status:", status_disponiveis, key="filtro_status_selectbox")
                 
-                # Aplicar filtros
-                df_filtrado = df_logs_historico.copy()
-                if filtro_agente != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Agente"] == filtro_agente]
-                if filtro_status != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Status"] == filtro_status]
+                # Aplicar filtros em uma máscara única sobre os arrays
+                # subjacentes — sem o .copy() do frame inteiro por rerun
+                if filtro_agente == "Todos" and filtro_status == "Todos":
+                    df_filtrado = df_logs_historico
+                else:
+                    import numpy as np
+
+                    mask = np.ones(len(df_logs_historico), dtype=bool)
+                    if filtro_agente != "Todos":
+                        mask &= df_logs_historico["Agente"].values == filtro_agente
+                    if filtro_status != "Todos":
+                        mask &= df_logs_historico["Status"].values == filtro_status
+                    df_filtrado = df_logs_historico.iloc[mask]
                 
-                # Exibir grid filtrado
+                # Exibir grid filtrado — key estável permite ao frontend
+                # reutilizar o componente entre reruns em vez de remontá-lo
                 st.dataframe(
                     df_filtrado,
+                    key="log_hist_grid",
                     use_container_width=True,
                     height=400,
                     column_config={
@@ -443,51 +874,43 @@ def exibir_resultados_processamento():
                     hide_index=True
                 )
                 
-                # Estatísticas do processamento
+                # Estatísticas do processamento: um único grid em vez de
+                # três componentes st.metric (uma mensagem websocket só)
                 st.subheader("Estatísticas do Processamento")
-                col_stat1, col_stat2, col_stat3 = st.columns(3)
-                
-                with col_stat1:
-                    total_logs = len(df_logs_historico)
-                    st.metric("Total de Logs", total_logs)
-                
-                with col_stat2:
-                    agentes_executados = df_logs_historico["Agente"].nunique()
-                    st.metric("Agentes Executados", agentes_executados)
-                
-                with col_stat3:
-                    status_sucesso = len(df_logs_historico[df_logs_historico["Status"].str.contains("Concluído", na=False)])
-                    st.metric("Etapas Concluídas", status_sucesso)
+                estatisticas = pd.DataFrame(
+                    [
+                        ("Total de Logs", len(df_logs_historico)),
+                        ("Agentes Executados", df_logs_historico["Agente"].nunique()),
+                        ("Etapas Concluídas",
+                         int(df_logs_historico["Status"].str.contains("Concluído", na=False).sum())),
+                    ],
+                    columns=["Métrica", "Valor"],
+                )
+                st.dataframe(estatisticas, hide_index=True, use_container_width=True)
                 
                 # Botões de ação para os logs
                 col_btn1, col_btn2, col_btn3 = st.columns(3)
                 
                 with col_btn1:
                     if st.button("Limpar Logs", help="Remove todos os logs do histórico"):
-                        st.session_state.log_processamento = []
+                        st.session_state.log_processamento = deque(maxlen=50)
                         st.rerun()
                 
                 with col_btn2:
                     # Exportar logs para CSV
-                    csv_logs = df_filtrado.to_csv(index=False)
                     st.download_button(
                         label="Exportar Logs (CSV)",
-                        data=csv_logs,
+                        data=_logs_para_download(df_filtrado, 'csv'),
                         file_name=f"logs_processamento_{timestamp_proc}.csv",
                         mime="text/csv",
                         help="Baixa os logs filtrados em formato CSV"
                     )
                 
                 with col_btn3:
-                    # Exportar logs para Excel  
-                    buffer_logs = BytesIO()
-                    with pd.ExcelWriter(buffer_logs, engine='xlsxwriter') as writer:
-                        df_filtrado.to_excel(writer, sheet_name='Logs_Processamento', index=False)
-                    buffer_logs.seek(0)
-                    
+                    # Exportar logs para Excel
                     st.download_button(
                         label="Exportar Logs (Excel)",
-                        data=buffer_logs.getvalue(),
+                        data=_logs_para_download(df_filtrado, 'xlsx'),
                         file_name=f"logs_processamento_{timestamp_proc}.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         help="Baixa os logs filtrados em formato Excel"
@@ -496,26 +919,32 @@ def exibir_resultados_processamento():
             else:
                 st.info("Nenhum log de processamento disponível.")
         
-        # Mostrar resumo executivo
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Oportunidades", resumo_execucao.get('total_oportunidades', 0))
-        with col2:
-            st.metric("Discrepâncias", resumo_execucao.get('total_discrepancias', 0))
-        with col3:
-            st.metric("Soluções", resumo_execucao.get('total_solucoes', 0))
-        with col4:
-            st.metric("Produtos", resumo_execucao.get('produtos_analisados', 0))
+        # Mostrar resumo executivo em um único grid (quatro st.metric em
+        # colunas separadas custam quatro mensagens websocket por rerun)
+        resumo_df = pd.DataFrame(
+            [
+                ("Oportunidades", resumo_execucao.get('total_oportunidades', 0)),
+                ("Discrepâncias", resumo_execucao.get('total_discrepancias', 0)),
+                ("Soluções", resumo_execucao.get('total_solucoes', 0)),
+                ("Produtos", resumo_execucao.get('produtos_analisados', 0)),
+            ],
+            columns=["Métrica", "Valor"],
+        )
+        st.dataframe(resumo_df, hide_index=True, use_container_width=True)
         
         # Botões de ação
         
-        # Gerar PDF com key único para evitar conflitos
+        # Coletar o PDF gerado em paralelo com a renderização acima
         pdf_data = None
         pdf_file_name = None
         try:
-            pdf_data = gerar_relatorio_pdf(resultado_completo, arquivo_nome)
+            if pdf_future is None:
+                pdf_data = st.session_state.pdf_data_report
+            else:
+                pdf_data = pdf_future.result()
             if pdf_data:
                 pdf_file_name = f"relatorio_fiscal_{timestamp_proc.replace(':', '-')[:19]}.pdf"
+                st.session_state.pdf_cache_key = pdf_cache_key
             else:
                 st.error("Erro ao gerar relatório PDF")
         except Exception as e:
@@ -534,80 +963,268 @@ def exibir_resultados_processamento():
         st.session_state.agentes_processados = False
         return None, None
 
-def salvar_dados_temporarios(cabecalho_df, produtos_df, resultado_completo, nome_arquivo):
-    """Salva dados em arquivo temporário JSON para persistência"""
-    import json
+def salvar_dados_temporarios(cabecalho_df, produtos_df, resultado_completo, nome_arquivo, file_key=None):
+    """Salva dados em arquivos temporários (JSON de metadados + Parquet) para persistência.
+
+    Os DataFrames vão em Parquet em vez de to_dict('records') dentro do JSON:
+    a escrita colunar evita alocar um dict Python por linha, preserva dtypes
+    (JSON degrada tudo para str no reload) e gera arquivos bem menores.
+    O JSON de metadados sai compacto via orjson (que também serializa
+    escalares numpy direto); json da stdlib é o fallback.
+
+    A escrita em disco (Parquet + JSON) roda em segundo plano no executor do
+    módulo: o rerun do Streamlit não fica bloqueado esperando I/O de arquivo.
+    """
     import os
     from datetime import datetime
-    
+
     try:
         dados_temporarios = {
             'timestamp_salvamento': datetime.now().isoformat(),
             'arquivo_xml_nome': nome_arquivo,
-            'cabecalho_df': cabecalho_df.to_dict('records'),
-            'produtos_df': produtos_df.to_dict('records'),
+            'file_key': file_key,
             'resultado_validador': resultado_completo.get('validador', {}),
             'resultado_analista': resultado_completo.get('analista', {}),
             'resultado_tributarista': resultado_completo.get('tributarista', {}),
             'resumo_execucao': resultado_completo.get('resumo_execucao', {}),
             'timestamp_processamento': resultado_completo.get('timestamp_processamento')
         }
-        
+
         # Salvar no diretório raiz do projeto
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         arquivo_temp = os.path.join(base_dir, 'temp_nfe_data.json')
-        
-        with open(arquivo_temp, 'w', encoding='utf-8') as f:
-            json.dump(dados_temporarios, f, ensure_ascii=False, indent=2)
-            
+
+        try:
+            import orjson
+            payload = orjson.dumps(dados_temporarios, option=orjson.OPT_SERIALIZE_NUMPY)
+        except ImportError:
+            import json
+            payload = json.dumps(dados_temporarios, ensure_ascii=False).encode('utf-8')
+
+        def _escrever_temp():
+            # Parquet e JSON fora da thread principal; chamadas st.* não
+            # funcionam aqui, então falhas vão para o terminal
+            try:
+                cabecalho_df.to_parquet(os.path.join(base_dir, 'temp_nfe_cabecalho.parquet'))
+                produtos_df.to_parquet(os.path.join(base_dir, 'temp_nfe_produtos.parquet'))
+                with open(arquivo_temp, 'wb') as f:
+                    f.write(payload)
+            except Exception as e:
+                print(f"Erro ao salvar dados temporários em segundo plano: {e}")
+
+        _PDF_EXECUTOR.submit(_escrever_temp)
+
         st.success("Dados salvos em arquivo temporário")
-        
+
     except Exception as e:
         st.warning(f"Erro ao salvar dados temporários: {str(e)}")
 
 
+# Negrito markdown (**texto**) compilado uma única vez no import do módulo
+_MD_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+
+
+@functools.lru_cache(maxsize=1)
+def _pdf_styles():
+    """Stylesheet e estilos derivados do relatório, construídos uma vez.
+
+    getSampleStyleSheet monta dezenas de ParagraphStyles a cada chamada;
+    como os estilos são imutáveis depois de prontos, a primeira geração de
+    PDF paga o custo e as seguintes reutilizam. Fica atrás de lru_cache
+    (e não em escopo de módulo) para preservar o import adiado do reportlab.
+    """
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+
+    styles = getSampleStyleSheet()
+    body_style = ParagraphStyle('BodyText', parent=styles['Normal'],
+                                alignment=TA_JUSTIFY, leading=14)
+    titulo_style = ParagraphStyle('CustomTitle', parent=styles['Title'],
+                                  fontSize=18, spaceAfter=30, alignment=TA_CENTER)
+    return styles, body_style, titulo_style
+
+
+@functools.lru_cache(maxsize=1)
+def _md_table_style():
+    """TableStyle único para as tabelas markdown dos relatórios."""
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ])
+
+
+@functools.lru_cache(maxsize=1)
+def _logo_bytes():
+    """Bytes da logo lidos do disco uma única vez por processo."""
+    with open("assets/LOGO.png", "rb") as f:
+        return f.read()
+
+
+def _markdown_para_flowables(texto, styles, body_style):
+    """Converte markdown simples dos relatórios em flowables do ReportLab.
+
+    Classifica cada linha em uma única passada e agrupa linhas de texto
+    corrido consecutivas em um só Paragraph (separadas por <br/>), o que
+    reduz bastante o número de flowables que o doc.build precisa paginar.
+    Linhas de tabela (|) contíguas viram um único Table — layout O(células)
+    em vez de um Paragraph com word-wrap por linha, e renderiza como grade.
+    """
+    from reportlab.platypus import Paragraph, Spacer, Table
+
+    # Estilos e espaçadores resolvidos uma vez fora do loop: cada Spacer é
+    # stateless no build, então uma instância por tamanho basta
+    h2 = styles['Heading2']
+    h3 = styles['Heading3']
+    h4 = styles['Heading4']
+    s6, s8, s10, s12 = Spacer(1, 6), Spacer(1, 8), Spacer(1, 10), Spacer(1, 12)
+
+    flowables = []
+    texto_corrido = []
+    tabela_linhas = []
+
+    def _descarregar_corrido():
+        if texto_corrido:
+            flowables.append(Paragraph("<br/>".join(texto_corrido), body_style))
+            texto_corrido.clear()
+
+    def _descarregar_tabela():
+        if tabela_linhas:
+            # Normaliza a largura das linhas (o Table exige grade retangular)
+            largura = max(len(l) for l in tabela_linhas)
+            dados = [l + [''] * (largura - len(l)) for l in tabela_linhas]
+            flowables.append(Table(dados, style=_md_table_style(), hAlign='LEFT'))
+            flowables.append(s6)
+            tabela_linhas.clear()
+
+    def _descarregar_pendentes():
+        # No máximo um dos buffers está preenchido num dado momento (cada
+        # tipo de linha descarrega o buffer do outro antes de acumular),
+        # então a ordem dos flushes aqui não reordena conteúdo
+        _descarregar_corrido()
+        _descarregar_tabela()
+
+    for linha in texto.split('\n'):
+        linha = linha.strip()
+        if not linha:
+            _descarregar_pendentes()
+            flowables.append(s6)
+            continue
+
+        # Caminho rápido para o caso dominante (texto corrido): um teste de
+        # primeiro caractere pula a cadeia de startswith das linhas marcadas
+        if linha[0] not in '#-|' and '|' not in linha:
+            _descarregar_tabela()
+            texto_corrido.append(_MD_BOLD_RE.sub(r"<b>\1</b>", linha))
+            continue
+
+        # Títulos secundários (###)
+        if linha.startswith('### '):
+            _descarregar_pendentes()
+            flowables.append(Paragraph(f"<b>{linha[4:].strip()}</b>", h4))
+            flowables.append(s6)
+
+        # Títulos principais (##)
+        elif linha.startswith('## '):
+            _descarregar_pendentes()
+            flowables.append(Paragraph(f"<b>{linha[3:].strip()}</b>", h3))
+            flowables.append(s8)
+
+        # Título principal (#)
+        elif linha.startswith('# '):
+            _descarregar_pendentes()
+            flowables.append(Paragraph(f"<b>{linha[2:].strip()}</b>", h2))
+            flowables.append(s10)
+
+        # Separadores (---)
+        elif linha.startswith('---'):
+            _descarregar_pendentes()
+            flowables.append(s12)
+
+        # Tabelas markdown (|): acumula as linhas contíguas e o flush monta
+        # um único Table (a linha separadora |---| é descartada)
+        elif '|' in linha:
+            if not linha.startswith('|---'):
+                colunas = [col.strip() for col in linha.split('|') if col.strip()]
+                if colunas:
+                    _descarregar_corrido()
+                    tabela_linhas.append(colunas)
+
+        # Lista com bullet points (-)
+        elif linha.startswith('- '):
+            _descarregar_pendentes()
+            item = _MD_BOLD_RE.sub(r"<b>\1</b>", linha[2:].strip())
+            flowables.append(Paragraph(f"• {item}", body_style))
+
+        # Texto normal (negrito inline resolvido pelo regex pré-compilado)
+        else:
+            _descarregar_tabela()
+            texto_corrido.append(_MD_BOLD_RE.sub(r"<b>\1</b>", linha))
+
+    _descarregar_pendentes()
+    return flowables
+
+
 def gerar_relatorio_pdf(resultado_completo, nome_arquivo):
     """Gera relatório PDF com insights dos 3 agentes"""
+    # Imports adiados (cold start sem reportlab), mas com o ImportError
+    # tratado aqui fora — o corpo quente da função não carrega o handler
     try:
-        from reportlab.lib.pagesizes import letter, A4
+        from reportlab.lib.pagesizes import A4
         from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-        from reportlab.lib.units import inch
         from reportlab.lib import colors
-        from io import BytesIO
-        from datetime import datetime
-        
+    except ImportError:
+        # A função roda na thread do pool, onde st.* não renderiza; o erro
+        # vai para o terminal e o chamador exibe um st.error único ao
+        # receber None
+        print("Biblioteca reportlab não instalada. Execute: pip install reportlab",
+              file=sys.stderr)
+        return None
+
+    from datetime import datetime
+    from xml.sax.saxutils import escape
+
+    try:
         # Buffer para PDF
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        
-        # Estilo do corpo do texto
-        body_style = ParagraphStyle('BodyText', parent=styles['Normal'], alignment=TA_JUSTIFY, leading=14)
+        # Stylesheet e estilos derivados memoizados (ver _pdf_styles)
+        styles, body_style, titulo_style = _pdf_styles()
+
+        # Estilos e espaçadores resolvidos uma vez para a função toda; um
+        # Spacer por tamanho basta (flowable sem estado, o ReportLab
+        # tolera reuso)
+        h2 = styles['Heading2']
+        h3 = styles['Heading3']
+        spacer12 = Spacer(1, 12)
+        spacer20 = Spacer(1, 20)
 
         story = []
         
-        # Adicionar a logo
-        logo = "assets/LOGO.png"
-        img = Image(logo, width=100, height=100)
+        # Adicionar a logo (bytes memoizados — sem leitura de disco por PDF)
+        img = Image(BytesIO(_logo_bytes()), width=100, height=100)
         img.hAlign = 'CENTER'
         story.append(img)
-        story.append(Spacer(1, 12))
+        story.append(spacer12)
 
         # Título
-        titulo_style = ParagraphStyle('CustomTitle', parent=styles['Title'], fontSize=18, spaceAfter=30, alignment=TA_CENTER)
         story.append(Paragraph("Relatório de Análise Fiscal", titulo_style))
-        story.append(Spacer(1, 12))
+        story.append(spacer12)
         
         # Informações básicas
         story.append(Paragraph(f"<b>Arquivo:</b> {nome_arquivo}", body_style))
         story.append(Paragraph(f"<b>Data do Processamento:</b> {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", body_style))
-        story.append(Spacer(1, 20))
-        
+        story.append(spacer20)
+
         # Resumo Executivo
         resumo = resultado_completo.get('resumo_execucao', {})
-        story.append(Paragraph("<b>RESUMO EXECUTIVO</b>", styles['Heading2']))
+        story.append(Paragraph("<b>RESUMO EXECUTIVO</b>", h2))
         
         # Tabela de métricas
         dados_metricas = [
@@ -631,153 +1248,92 @@ def gerar_relatorio_pdf(resultado_completo, nome_arquivo):
         ]))
         
         story.append(tabela_metricas)
-        story.append(Spacer(1, 20))
-        
+        story.append(spacer20)
+
         # Oportunidades do Validador
         validador = resultado_completo.get('validador', {})
         oportunidades = validador.get('oportunidades', [])
-        
+
         if oportunidades:
-            story.append(Paragraph("<b>OPORTUNIDADES IDENTIFICADAS</b>", styles['Heading2']))
+            story.append(Paragraph("<b>OPORTUNIDADES IDENTIFICADAS</b>", h2))
             for i, oport in enumerate(oportunidades, 1):
-                story.append(Paragraph(f"<b>{i}. {oport.get('tipo', 'N/A')}</b>", styles['Heading3']))
-                story.append(Paragraph(f"<b>Produto:</b> {oport.get('produto', 'N/A')}", body_style))
-                story.append(Paragraph(f"<b>Descrição:</b> {oport.get('descricao', 'N/A')}", body_style))
-                story.append(Paragraph(f"<b>Impacto:</b> {oport.get('impacto', 'N/A')}", body_style))
-                story.append(Paragraph(f"<b>Ação Recomendada:</b> {oport.get('acao_recomendada', 'N/A')}", body_style))
-                story.append(Spacer(1, 12))
-        
+                story.append(Paragraph(f"<b>{i}. {escape(str(oport.get('tipo', 'N/A')))}</b>", h3))
+                # Um Paragraph por achado em vez de quatro: cada Paragraph
+                # re-parseia seu mini-XML, então o custo cai com o batch
+                corpo = "<br/>".join((
+                    f"<b>Produto:</b> {escape(str(oport.get('produto', 'N/A')))}",
+                    f"<b>Descrição:</b> {escape(str(oport.get('descricao', 'N/A')))}",
+                    f"<b>Impacto:</b> {escape(str(oport.get('impacto', 'N/A')))}",
+                    f"<b>Ação Recomendada:</b> {escape(str(oport.get('acao_recomendada', 'N/A')))}",
+                ))
+                story.append(Paragraph(corpo, body_style))
+                story.append(spacer12)
+
         # Discrepâncias
         discrepancias = validador.get('discrepancias', [])
         if discrepancias:
-            story.append(Paragraph("<b>DISCREPÂNCIAS ENCONTRADAS</b>", styles['Heading2']))
+            story.append(Paragraph("<b>DISCREPÂNCIAS ENCONTRADAS</b>", h2))
             for i, disc in enumerate(discrepancias, 1):
-                story.append(Paragraph(f"<b>{i}. {disc.get('tipo', 'N/A')} ({disc.get('gravidade', 'N/A')})</b>", styles['Heading3']))
-                story.append(Paragraph(f"<b>Produto:</b> {disc.get('produto', 'N/A')}", body_style))
-                story.append(Paragraph(f"<b>Problema:</b> {disc.get('problema', 'N/A')}", body_style))
-                story.append(Paragraph(f"<b>Correção:</b> {disc.get('correcao', 'N/A')}", body_style))
-                story.append(Spacer(1, 12))
+                story.append(Paragraph(
+                    f"<b>{i}. {escape(str(disc.get('tipo', 'N/A')))} ({escape(str(disc.get('gravidade', 'N/A')))})</b>", h3))
+                corpo = "<br/>".join((
+                    f"<b>Produto:</b> {escape(str(disc.get('produto', 'N/A')))}",
+                    f"<b>Problema:</b> {escape(str(disc.get('problema', 'N/A')))}",
+                    f"<b>Correção:</b> {escape(str(disc.get('correcao', 'N/A')))}",
+                ))
+                story.append(Paragraph(corpo, body_style))
+                story.append(spacer12)
 
         # Relatório Final do Analista (se disponível)
         analista = resultado_completo.get('analista', {})
         if analista.get('status') == 'sucesso' and analista.get('relatorio_final'):
-            story.append(Paragraph("<b>ANÁLISE DETALHADA DO ANALISTA</b>", styles['Heading2']))
-            story.append(Spacer(1, 12))
-            
+            story.append(Paragraph("<b>ANÁLISE DETALHADA DO ANALISTA</b>", h2))
+            story.append(spacer12)
+
             # Processar relatório final do analista (markdown)
             relatorio_analista = analista.get('relatorio_final', '')
-            
-            # Processar markdown simples
-            linhas_analista = relatorio_analista.split('\n')
-            for linha in linhas_analista:
-                linha = linha.strip()
-                if not linha:
-                    story.append(Spacer(1, 6))
-                    continue
-                
-                if linha.startswith('##'):
-                    titulo = linha.replace('##', '').strip()
-                    story.append(Paragraph(f"<b>{titulo}</b>", styles['Heading3']))
-                elif linha.startswith('**') and linha.endswith('**'):
-                    texto_negrito = linha.replace('**', '').strip()
-                    story.append(Paragraph(f"<b>{texto_negrito}</b>", body_style))
-                elif linha.startswith('- '):
-                    item = linha.replace('- ', '').strip()
-                    story.append(Paragraph(f"• {item}", body_style))
-                else:
-                    if linha and not linha.startswith('---'):
-                        story.append(Paragraph(linha, body_style))
-            
-            story.append(Spacer(1, 20))
+            story.extend(_markdown_para_flowables(relatorio_analista, styles, body_style))
+            story.append(spacer20)
         
         # Relatório Híbrido do Tributarista (COMPLETO)
         tributarista = resultado_completo.get('tributarista', {})
         if tributarista.get('status') == 'sucesso' and tributarista.get('relatorio_hibrido'):
-            story.append(Paragraph("<b>RELATÓRIO TRIBUTÁRIO COMPLETO</b>", styles['Heading2']))
-            story.append(Spacer(1, 12))
-            
+            story.append(Paragraph("<b>RELATÓRIO TRIBUTÁRIO COMPLETO</b>", h2))
+            story.append(spacer12)
+
             # Converter markdown do relatório híbrido para PDF
             relatorio_markdown = tributarista.get('relatorio_hibrido', '')
-            
-            # Processar o markdown linha por linha
-            linhas = relatorio_markdown.split('\n')
-            for linha in linhas:
-                linha = linha.strip()
-                if not linha:
-                    story.append(Spacer(1, 6))
-                    continue
-                
-                # Títulos principais (##)
-                if linha.startswith('## '):
-                    titulo = linha.replace('## ', '').strip()
-                    story.append(Paragraph(f"<b>{titulo}</b>", styles['Heading3']))
-                    story.append(Spacer(1, 8))
-                
-                # Títulos secundários (###)
-                elif linha.startswith('### '):
-                    subtitulo = linha.replace('### ', '').strip()
-                    story.append(Paragraph(f"<b>{subtitulo}</b>", styles['Heading4']))
-                    story.append(Spacer(1, 6))
-                
-                # Título principal (#)
-                elif linha.startswith('# '):
-                    titulo_principal = linha.replace('# ', '').strip()
-                    story.append(Paragraph(f"<b>{titulo_principal}</b>", styles['Heading2']))
-                    story.append(Spacer(1, 10))
-                
-                # Tabelas markdown (|)
-                elif '|' in linha and not linha.startswith('|---'):
-                    # Processar tabela markdown simples
-                    colunas = [col.strip() for col in linha.split('|') if col.strip()]
-                    if colunas:
-                        # Criar linha de tabela simples
-                        linha_tabela = ' | '.join(colunas)
-                        story.append(Paragraph(linha_tabela, body_style))
-                
-                # Lista com bullet points (-)
-                elif linha.startswith('- '):
-                    item = linha.replace('- ', '').strip()
-                    story.append(Paragraph(f"• {item}", body_style))
-                
-                # Texto em negrito (**texto**)
-                elif '**' in linha:
-                    # Substituir **texto** por <b>texto</b>
-                    linha_formatada = linha.replace('**', '<b>', 1).replace('**', '</b>', 1)
-                    # Continuar substituindo se houver mais
-                    while '**' in linha_formatada:
-                        linha_formatada = linha_formatada.replace('**', '<b>', 1).replace('**', '</b>', 1)
-                    story.append(Paragraph(linha_formatada, body_style))
-                
-                # Separadores (---)
-                elif linha.startswith('---'):
-                    story.append(Spacer(1, 12))
-                
-                # Texto normal
-                else:
-                    if linha:
-                        story.append(Paragraph(linha, body_style))
-            
-            story.append(Spacer(1, 20))
+            story.extend(_markdown_para_flowables(relatorio_markdown, styles, body_style))
+            story.append(spacer20)
         
-        # Gerar PDF
+        # Gerar PDF. Retorna bytes (uma cópia): o session_state e o
+        # download_button do Streamlit esperam bytes, e um memoryview
+        # zero-copy prenderia o buffer inteiro vivo por referência
         doc.build(story)
-        buffer.seek(0)
         return buffer.getvalue()
-        
-    except ImportError:
-        st.error("Biblioteca reportlab não instalada. Execute: pip install reportlab")
-        return None
+
     except Exception as e:
-        st.error(f"Erro ao gerar PDF: {str(e)}")
+        # Mesma razão do ImportError acima: log no terminal, UI avisada
+        # pelo chamador via retorno None
+        print(f"Erro ao gerar PDF: {e}", file=sys.stderr)
         return None
 
 def gerar_zip_relatorio_e_xml(xml_content, pdf_data, xml_file_name, pdf_file_name):
-    """Gera um arquivo ZIP contendo o XML original e o relatório PDF."""
+    """Gera um arquivo ZIP contendo o XML original e o relatório PDF.
+
+    Compressão por membro: o XML (texto repetitivo) comprime bem com deflate
+    nível 3; o PDF já sai comprimido do ReportLab, então entra armazenado
+    (ZIP_STORED) — deflatar de novo só gastaria CPU sem ganho de tamanho.
+    """
     try:
         zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-            zip_file.writestr(xml_file_name, xml_content.encode("utf-8"))
-            zip_file.writestr(pdf_file_name, pdf_data)
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
+            if isinstance(xml_content, str):
+                xml_content = xml_content.encode("utf-8")
+            zip_file.writestr(xml_file_name, xml_content,
+                              compress_type=zipfile.ZIP_DEFLATED, compresslevel=3)
+            zip_file.writestr(pdf_file_name, pdf_data,
+                              compress_type=zipfile.ZIP_STORED)
         return zip_buffer.getvalue()
     except Exception as e:
         st.error(f"Erro ao gerar ZIP: {str(e)}")
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import json
-import xml.etree.ElementTree as ET
 from datetime import datetime
 import io
 import base64
@@ -1037,8 +1036,17 @@ def carregar_dados_temporarios():
         if os.path.exists(arquivo_temp):
             with open(arquivo_temp, 'r', encoding='utf-8') as f:
                 dados = json.load(f)
-                st.success(f"Dados carregados do arquivo temporário (salvo em: {dados.get('timestamp_salvamento', 'N/A')})")
-                return dados
+
+            # DataFrames persistidos em Parquet ao lado do JSON de metadados
+            # (formato antigo embutia os registros no próprio JSON)
+            for chave, arquivo in (('cabecalho_df', 'temp_nfe_cabecalho.parquet'),
+                                   ('produtos_df', 'temp_nfe_produtos.parquet')):
+                caminho = os.path.join(base_dir, arquivo)
+                if chave not in dados and os.path.exists(caminho):
+                    dados[chave] = pd.read_parquet(caminho)
+
+            st.success(f"Dados carregados do arquivo temporário (salvo em: {dados.get('timestamp_salvamento', 'N/A')})")
+            return dados
         else:
             st.warning(f"Arquivo temporário não encontrado em: {arquivo_temp}")
             return None
@@ -1052,11 +1060,15 @@ def restaurar_dados_sessao(dados_temp):
     """Restaura dados na sessão a partir do arquivo temporário"""
     try:
         # Restaurar DataFrames
-        if 'cabecalho_df' not in st.session_state and dados_temp.get('cabecalho_df'):
-            st.session_state.cabecalho_df = pd.DataFrame(dados_temp['cabecalho_df'])
-            
-        if 'produtos_df' not in st.session_state and dados_temp.get('produtos_df'):
-            st.session_state.produtos_df = pd.DataFrame(dados_temp['produtos_df'])
+        # dados_temp pode trazer DataFrames (Parquet) ou listas de registros
+        # (formato JSON antigo); len() cobre os dois casos
+        cabecalho = dados_temp.get('cabecalho_df')
+        if 'cabecalho_df' not in st.session_state and cabecalho is not None and len(cabecalho):
+            st.session_state.cabecalho_df = pd.DataFrame(cabecalho)
+
+        produtos = dados_temp.get('produtos_df')
+        if 'produtos_df' not in st.session_state and produtos is not None and len(produtos):
+            st.session_state.produtos_df = pd.DataFrame(produtos)
         
         # Restaurar resultados dos agentes
         st.session_state.resultado_validador = dados_temp.get('resultado_validador', {})
@@ -1066,6 +1078,7 @@ def restaurar_dados_sessao(dados_temp):
         
         # Restaurar outras informações
         st.session_state.arquivo_xml_nome = dados_temp.get('arquivo_xml_nome', 'Arquivo não identificado')
+        st.session_state.agentes_file_key = dados_temp.get('file_key')
         st.session_state.agentes_processados = True
         st.session_state.timestamp_processamento = dados_temp.get('timestamp_processamento')
         
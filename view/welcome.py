@@ -1,7 +1,5 @@
 
 import streamlit as st
-from io import BytesIO
-import pandas as pd
 from view.login import login_page
 
 # ==============================